@@ -1,8 +1,28 @@
+import os
 import sys
 import json
+import pickle
+import hashlib
+import logging
 import random
+from dataclasses import dataclass, asdict
+from collections import defaultdict
 from io import BytesIO
-import matplotlib.pyplot as plt
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+from matplotlib import mathtext
+from matplotlib.font_manager import FontProperties
+try:
+    import orjson
+except ImportError:  # optional: fall back to the stdlib encoder
+    orjson = None
+try:
+    # Streaming is only worth it with the C backend; pure-Python ijson is slower
+    # than loading the whole document.
+    import ijson.backends.yajl2_c as ijson
+except ImportError:
+    ijson = None
 
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QGraphicsScene, QGraphicsView, QVBoxLayout,
@@ -10,17 +30,316 @@ from PyQt5.QtWidgets import (
     QLabel, QLineEdit, QPushButton, QGraphicsRectItem, QGraphicsTextItem,
     QGraphicsEllipseItem, QSizePolicy, QGraphicsLineItem, QMessageBox
 )
-from PyQt5.QtCore import Qt, QRectF, QPointF
-from PyQt5.QtGui import QColor, QPen, QBrush, QPixmap, QImage, QPainter
+from PyQt5.QtCore import (
+    Qt, QRectF, QPointF, QTimer, QObject, QRunnable, QThreadPool, pyqtSignal
+)
+from PyQt5.QtGui import QColor, QPen, QBrush, QPixmap, QImage, QPainter, QPixmapCache
+
+log = logging.getLogger(__name__)
+
+# Shared paint objects; QPen construction is costly, so reuse them.
+_PEN_POOL = {}  # (color, width) -> QPen
+
+def _pen(color, width):
+    # Pooled pens: connections with the same style share one QPen.
+    pen = _PEN_POOL.get((color, width))
+    if pen is None:
+        pen = _PEN_POOL[(color, width)] = QPen(QColor(color), width)
+    return pen
+
+_LATEX_FONT = FontProperties(size=20)
+
+def _json_dump_record(record):
+    # One compact record as UTF-8 bytes.
+    if orjson is not None:
+        return orjson.dumps(record)
+    return json.dumps(record, ensure_ascii=False, default=asdict).encode("utf-8")
+
+def _write_json_sections(f, sections):
+    """
+    Writes {"name": [record, ...], ...} to a binary file one record at a time,
+    so the whole document never has to exist in memory.
+    """
+    f.write(b"{")
+    for i, (name, records) in enumerate(sections):
+        if i:
+            f.write(b",")
+        f.write(b'\n  "' + name.encode("utf-8") + b'": [')
+        sep = b"\n    "
+        for record in records:
+            f.write(sep)
+            f.write(_json_dump_record(record))
+            sep = b",\n    "
+        f.write(b"\n  ]")
+    f.write(b"\n}\n")
+
+# Save-file records; field names are the on-disk JSON keys. __slots__ is
+# spelled out because dataclass(slots=True) needs Python 3.10.
+@dataclass
+class BlockSnap:
+    __slots__ = ("id", "title", "content", "x", "y", "width", "height", "color", "locked")
+    id: int
+    title: str
+    content: str
+    x: float
+    y: float
+    width: float
+    height: float
+    color: str
+    locked: bool
+
+@dataclass
+class ClusterSnap:
+    __slots__ = ("id", "title", "color", "block_ids", "locked")
+    id: int
+    title: str
+    color: str
+    block_ids: list
+    locked: bool
+
+@dataclass
+class ConnectionSnap:
+    __slots__ = ("start_block_id", "start_anchor", "end_block_id", "end_anchor")
+    start_block_id: int
+    start_anchor: str
+    end_block_id: int
+    end_anchor: str
+
+def _block_snap(block):
+    return BlockSnap(block.block_id, block.title, block.content, block._cached_x, block._cached_y,
+                     block._cached_w, block._cached_h, block.color, block.locked)
+
+def _cluster_snap(cid, cluster):
+    return ClusterSnap(cid, cluster.title, cluster.color,
+                       [blk.block_id for blk in cluster.blocks], cluster.locked)
+
+def _conn_snap(conn):
+    return ConnectionSnap(conn.start_anchor.parent_block.block_id, conn.start_anchor.orientation,
+                          conn.end_anchor.parent_block.block_id, conn.end_anchor.orientation)
+
+# Anchor orientations; a block's anchors tuple is indexed by _ORIENT_CODES.
+# The on-disk format keeps the orientation strings.
+ANCHOR_ORIENTATIONS = ("top", "bottom", "left", "right")
+_ORIENT_CODES = {orient: i for i, orient in enumerate(ANCHOR_ORIENTATIONS)}
+# Anchor centers as fractions of the block size, indexed by orientation code.
+_ANCHOR_FX = np.array([0.5, 0.5, 0.0, 1.0])
+_ANCHOR_FY = np.array([0.0, 1.0, 0.5, 0.5])
+
+def _connection_segments(conns):
+    """
+    Returns an (n, 4) array of x1, y1, x2, y2 scene coordinates, computed
+    from the blocks' cached geometry rather than per-anchor mapToScene calls.
+    """
+    n = len(conns)
+    if not n:
+        return np.empty((0, 4), np.float64)
+    geo = np.fromiter(
+        (v for conn in conns for anchor in (conn.start_anchor, conn.end_anchor)
+         for v in (anchor.parent_block._cached_x, anchor.parent_block._cached_y,
+                   anchor.parent_block._cached_w, anchor.parent_block._cached_h,
+                   _ORIENT_CODES[anchor.orientation])),
+        dtype=np.float64, count=10 * n
+    ).reshape(n, 2, 5)
+    codes = geo[:, :, 4].astype(np.intp)
+    xs = geo[:, :, 0] + geo[:, :, 2] * _ANCHOR_FX[codes]
+    ys = geo[:, :, 1] + geo[:, :, 3] * _ANCHOR_FY[codes]
+    return np.column_stack((xs[:, 0], ys[:, 0], xs[:, 1], ys[:, 1]))
+
+# Parsed graph files, one entry per path so a newer snapshot replaces the old
+# one; mtime + size are stored inside and checked on read. Bump the version
+# whenever the snapshot layout changes.
+_GRAPH_CACHE_VERSION = 1
+
+def _graph_cache_path(filename):
+    # None when there is no home directory to keep the cache in.
+    try:
+        cache_dir = Path.home() / ".cache" / "img" / "graph-cache"
+    except RuntimeError as e:
+        log.debug("Graph cache disabled: %s", e)
+        return None
+    key = f"v{_GRAPH_CACHE_VERSION}:{os.path.abspath(filename)}"
+    return cache_dir / hashlib.blake2b(key.encode("utf-8")).hexdigest()
+
+def _graph_cache_stamp(filename):
+    st = os.stat(filename)
+    return (_GRAPH_CACHE_VERSION, st.st_mtime_ns, st.st_size)
+
+def _read_graph_cache(cache, stamp):
+    try:
+        cached_stamp, sections = pickle.loads(cache.read_bytes())
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError) as e:
+        log.debug("Ignoring unreadable graph cache %s: %s", cache, e)
+        return None
+    return sections if cached_stamp == stamp else None
+
+def _json_loads(raw):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+def _iter_json_section(filename, name):
+    # Yields the items of a top-level array one dict at a time.
+    with open(filename, "rb") as f:
+        yield from ijson.items(f, name + ".item", use_float=True)
+
+def _read_graph_sections(filename):
+    """
+    Returns (blocks, clusters, connections) iterables for a graph file.
+    """
+    if ijson is not None:
+        return tuple(_iter_json_section(filename, name) for name in ("blocks", "clusters", "connections"))
+    with open(filename, "rb") as f:
+        data = _json_loads(f.read())
+    return data.get("blocks", []), data.get("clusters", []), data.get("connections", [])
+
+# -------------------------------------------
+# QuadTree spatial index for point hit-testing (anchor centers).
+# -------------------------------------------
+class QuadTree:
+    def __init__(self, bounds, capacity=10, max_depth=8, _depth=0):
+        """
+        bounds: (x, y, width, height) of the indexed area. Points outside the
+        root bounds are kept on the root node so nothing is ever lost.
+        """
+        self.bounds = bounds
+        self.capacity = capacity
+        self.max_depth = max_depth
+        self.depth = _depth
+        self.points = {}      # item -> (x, y) stored on this node
+        self.children = None  # four sub-nodes once split
+        self._positions = {} if _depth == 0 else None  # root only: item -> (x, y)
+
+    def _contains(self, x, y):
+        bx, by, bw, bh = self.bounds
+        return bx <= x < bx + bw and by <= y < by + bh
+
+    def _intersects(self, rect):
+        bx, by, bw, bh = self.bounds
+        return not (rect.right() < bx or rect.left() >= bx + bw or
+                    rect.bottom() < by or rect.top() >= by + bh)
+
+    def _childFor(self, x, y):
+        for child in self.children:
+            if child._contains(x, y):
+                return child
+        return None
+
+    def _split(self):
+        bx, by, bw, bh = self.bounds
+        hw, hh = bw / 2, bh / 2
+        self.children = [
+            QuadTree((bx + dx, by + dy, hw, hh), self.capacity, self.max_depth, self.depth + 1)
+            for dx, dy in ((0, 0), (hw, 0), (0, hh), (hw, hh))
+        ]
+        points, self.points = self.points, {}
+        for item, (x, y) in points.items():
+            self._place(item, x, y)
+
+    def _place(self, item, x, y):
+        node = self
+        while node.children:
+            child = node._childFor(x, y)
+            if child is None:
+                break
+            node = child
+        node.points[item] = (x, y)
+        if (node.children is None and len(node.points) > node.capacity
+                and node.depth < node.max_depth and node._contains(x, y)):
+            node._split()
+
+    def insert(self, item, x, y):
+        if item in self._positions:
+            self.remove(item)
+        self._positions[item] = (x, y)
+        self._place(item, x, y)
+
+    def remove(self, item):
+        pos = self._positions.pop(item, None)
+        if pos is None:
+            return
+        node = self
+        while item not in node.points and node.children:
+            node = node._childFor(*pos)
+            if node is None:
+                return
+        node.points.pop(item, None)
+
+    def update(self, items):
+        # Re-key each anchor on its current scene-space center.
+        for item in items:
+            center = item.sceneCenter()
+            self.insert(item, center.x(), center.y())
+
+    def clear(self):
+        self.points = {}
+        self.children = None
+        self._positions = {}
+
+    def rebuild(self, bounds):
+        # Re-place every item under new root bounds, e.g. after the scene grows.
+        positions = self._positions
+        self.clear()
+        self.bounds = bounds
+        for item, (x, y) in positions.items():
+            self.insert(item, x, y)
+
+    def query(self, rect):
+        found = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node is not self and not node._intersects(rect):
+                continue
+            for item, (x, y) in node.points.items():
+                if rect.left() <= x <= rect.right() and rect.top() <= y <= rect.bottom():
+                    found.append((item, x, y))
+            if node.children:
+                stack.extend(node.children)
+        return found
+
+# -------------------------------------------
+# Background LaTeX rendering.
+# -------------------------------------------
+class LatexSignals(QObject):
+    done = pyqtSignal(str, QImage)  # cache key, rendered image
+    failed = pyqtSignal(str)        # error message
+
+class LatexWorker(QRunnable):
+    def __init__(self, key, latex_code, block=None):
+        super().__init__()
+        self.key = key
+        self.latex_code = latex_code
+        self.block = block  # requesting block; only read back on the GUI thread
+        self.signals = LatexSignals()
+
+    def run(self):
+        # QImage is safe off the GUI thread; the QPixmap is built in the slot.
+        try:
+            buf = BytesIO()
+            mathtext.math_to_image(r"${}$".format(self.latex_code), buf, prop=_LATEX_FONT, dpi=100, format="png")
+            image = QImage.fromData(buf.getvalue())
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.done.emit(self.key, image)
 
 # -------------------------------------------
 # Custom QGraphicsView subclass for panning.
 # -------------------------------------------
 class MyGraphicsView(QGraphicsView):
+    viewChanged = pyqtSignal()  # emitted when the visible scene area moves or resizes
+
     def __init__(self, *args, **kwargs):
         super(MyGraphicsView, self).__init__(*args, **kwargs)
         self._isPanning = False
         self._panStart = QPointF()
+        self.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
+        # Pan deltas are accumulated and applied at most once per frame.
+        self._pendingPan = QPointF()
+        self._panTimer = QTimer(self)
+        self._panTimer.setSingleShot(True)
+        self._panTimer.setInterval(16)  # ~60 Hz
+        self._panTimer.timeout.connect(self._applyPan)
 
     def mousePressEvent(self, event):
         # If click on empty area (no item clicked) then start panning.
@@ -36,22 +355,39 @@ class MyGraphicsView(QGraphicsView):
 
     def mouseMoveEvent(self, event):
         if self._isPanning:
-            delta = self.mapToScene(event.pos()) - self.mapToScene(self._panStart)
+            self._pendingPan += self.mapToScene(event.pos()) - self.mapToScene(self._panStart)
             self._panStart = event.pos()
-            self.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
-            self.translate(delta.x() * -1, delta.y() * -1)
+            if not self._panTimer.isActive():
+                self._panTimer.start()
             event.accept()
             return
         super(MyGraphicsView, self).mouseMoveEvent(event)
+    
+    def _applyPan(self):
+        delta, self._pendingPan = self._pendingPan, QPointF()
+        if not delta.isNull():
+            self.translate(delta.x() * -1, delta.y() * -1)
+            self.viewChanged.emit()
 
     def mouseReleaseEvent(self, event):
         if event.button() == Qt.LeftButton and self._isPanning:
+            self._panTimer.stop()
+            self._applyPan()
             self._isPanning = False
             self.setCursor(Qt.ArrowCursor)
             event.accept()
             return
         super(MyGraphicsView, self).mouseReleaseEvent(event)
 
+    def scrollContentsBy(self, dx, dy):
+        # Scrollbars, the wheel and the keyboard all end up here.
+        super(MyGraphicsView, self).scrollContentsBy(dx, dy)
+        self.viewChanged.emit()
+
+    def resizeEvent(self, event):
+        super(MyGraphicsView, self).resizeEvent(event)
+        self.viewChanged.emit()
+
 # -------------------------------------------
 # ClickableLine for connections with crash prevention.
 # -------------------------------------------
@@ -64,12 +400,10 @@ class ClickableLine(QGraphicsLineItem):
             conn = self.connection_info
             try:
                 scene.removeItem(self)
-            except Exception as e:
-                print("Error removing connection line:", e)
-            editor = scene.editor
-            if conn in editor.connections:
-                editor.connections.remove(conn)
-            print("Зв'язок видалено.")
+            except Exception:
+                log.exception("Error removing connection line")
+            scene.editor.unregisterConnection(conn)
+            log.debug("Зв'язок видалено.")
         super().mousePressEvent(event)
 
 # -------------------------------------------
@@ -82,11 +416,17 @@ class GraphConnection:
         self.line_item = None
         self.scene = scene
 
-    def create_line_item(self):
-        start_point = self.start_anchor.sceneBoundingRect().center()
-        pen = QPen(Qt.darkGreen, 2)
-        self.line_item = ClickableLine(start_point.x(), start_point.y(), start_point.x(), start_point.y())
-        self.line_item.setPen(pen)
+    def create_line_item(self, segment=None):
+        """
+        segment: optional precomputed (x1, y1, x2, y2) scene coordinates.
+        """
+        if segment is None:
+            start_point = self.start_anchor.sceneCenter()
+            # Known endpoints (e.g. on load) give the final geometry in one go.
+            end_point = self.end_anchor.sceneCenter() if self.end_anchor else start_point
+            segment = (start_point.x(), start_point.y(), end_point.x(), end_point.y())
+        self.line_item = ClickableLine(*segment)
+        self.line_item.setPen(_pen(Qt.darkGreen, 2))
         self.line_item.setFlags(ClickableLine.ItemIsSelectable)
         self.line_item.connection_info = self
         self.scene.addItem(self.line_item)
@@ -94,9 +434,9 @@ class GraphConnection:
     def update_line_item(self, current_pos=None):
         if not self.line_item:
             return
-        start_point = self.start_anchor.sceneBoundingRect().center()
+        start_point = self.start_anchor.sceneCenter()
         if self.end_anchor:
-            end_point = self.end_anchor.sceneBoundingRect().center()
+            end_point = self.end_anchor.sceneCenter()
         elif current_pos is not None:
             end_point = current_pos
         else:
@@ -108,6 +448,9 @@ class GraphConnection:
 # -------------------------------------------
 class AnchorHandle(QGraphicsEllipseItem):
     HANDLE_SIZE = 8
+    # Shared by every handle; hover just swaps which brush is set.
+    _BRUSH_IDLE = QBrush(QColor("blue"))
+    _BRUSH_HOVER = QBrush(QColor("red"))
 
     def __init__(self, parent_block, orientation, editor):
         """
@@ -117,17 +460,26 @@ class AnchorHandle(QGraphicsEllipseItem):
         self.parent_block = parent_block
         self.orientation = orientation
         self.editor = editor
-        self.setBrush(QBrush(QColor("blue")))
+        self._scene_center = None  # cached scene-space center, reset when the block moves
+        self.setBrush(AnchorHandle._BRUSH_IDLE)
         self.setFlag(QGraphicsEllipseItem.ItemIsSelectable, False)
         self.setAcceptHoverEvents(True)
-        self.setAcceptedMouseButtons(Qt.LeftButton)
+        # Buttons are enabled only while the parent block is hovered, so Qt can
+        # skip idle handles during press propagation; release hit-testing uses
+        # editor.anchor_index instead.
+        self.setAcceptedMouseButtons(Qt.NoButton)
 
+    def sceneCenter(self):
+        if self._scene_center is None:
+            self._scene_center = self.mapToScene(self.boundingRect().center())
+        return self._scene_center
+    
     def hoverEnterEvent(self, event):
-        self.setBrush(QBrush(QColor("red")))
+        self.setBrush(AnchorHandle._BRUSH_HOVER)
         super().hoverEnterEvent(event)
 
     def hoverLeaveEvent(self, event):
-        self.setBrush(QBrush(QColor("blue")))
+        self.setBrush(AnchorHandle._BRUSH_IDLE)
         super().hoverLeaveEvent(event)
 
     def mousePressEvent(self, event):
@@ -139,12 +491,7 @@ class AnchorHandle(QGraphicsEllipseItem):
 
     def mouseReleaseEvent(self, event):
         if event.button() == Qt.LeftButton:
-            items_at_pos = self.editor.scene.items(event.scenePos())
-            target_anchor = None
-            for item in items_at_pos:
-                if isinstance(item, AnchorHandle) and item != self:
-                    target_anchor = item
-                    break
+            target_anchor = self.editor.anchorAt(event.scenePos(), exclude=self)
             if target_anchor:
                 self.editor.endConnection(target_anchor)
                 event.accept()
@@ -154,16 +501,28 @@ class AnchorHandle(QGraphicsEllipseItem):
         else:
             super().mouseReleaseEvent(event)
 
+def _item_flags(locked):
+    # Blocks and clusters are always selectable and report scene moves;
+    # locked items just leave out ItemIsMovable.
+    flags = QGraphicsRectItem.ItemIsSelectable | QGraphicsRectItem.ItemSendsScenePositionChanges
+    if not locked:
+        flags |= QGraphicsRectItem.ItemIsMovable
+    return flags
+
 # -------------------------------------------
 # GraphBlock represents a block on the scene.
 # -------------------------------------------
 class GraphBlock(QGraphicsRectItem):
-    def __init__(self, rect, title="Block", editor=None):
+    def __init__(self, rect, title="Block", editor=None, locked=False, pos=None):
         super().__init__(rect)
         self.block_id = None
+        self._last_update_pos = QPointF()  # scene pos at the last connection refresh
+        self._last_local_pos = QPointF()   # pos() at the last scene-position change
+        # Plain-float geometry mirror read by saveFile.
+        self._cached_x = self._cached_y = 0.0
+        self._cached_w, self._cached_h = rect.width(), rect.height()
         # Allow selection but movement is controlled by the locked flag.
-        self.setFlags(QGraphicsRectItem.ItemIsSelectable | QGraphicsRectItem.ItemSendsScenePositionChanges)
-        self.setFlag(QGraphicsRectItem.ItemIsMovable, True)
+        self.setFlags(_item_flags(locked))
         self.editor = editor
         self.title = title
         self.content = ""
@@ -171,11 +530,16 @@ class GraphBlock(QGraphicsRectItem):
         self.textItem = QGraphicsTextItem(title, self)
         self.textItem.setDefaultTextColor(Qt.black)
         self.centerText()
-        self.anchors = {}
-        for orient in ["top", "bottom", "left", "right"]:
-            self.anchors[orient] = AnchorHandle(self, orient, editor)
-        self.updateAnchors()
-        self.locked = False  # False means movable.
+        self.anchors = ()  # AnchorHandles indexed by _ORIENT_CODES, created on first hover/use
+        self.setAcceptHoverEvents(True)
+        # setPos() goes through the ItemPositionChange lock guard, so place the
+        # block before it is locked.
+        self.locked = False
+        if pos is not None:
+            self.setPos(pos)
+        self.locked = locked  # False means movable.
+        # Static appearance: blit a cached pixmap instead of repainting on pans.
+        self.setCacheMode(QGraphicsRectItem.DeviceCoordinateCache)
     
     def centerText(self):
         rect = self.rect()
@@ -191,16 +555,43 @@ class GraphBlock(QGraphicsRectItem):
     
     def setBlockRect(self, newRect):
         self.setRect(newRect)
+        self._cached_w, self._cached_h = newRect.width(), newRect.height()
         self.centerText()
         self.updateAnchors()
+        if self.editor and self.scene() is not None:
+            self.editor.trackBlockPosition(self)
+    
+    def ensureAnchors(self):
+        # Anchors are materialized lazily so freshly loaded blocks stay light.
+        if not self.anchors:
+            self.anchors = tuple(AnchorHandle(self, orient, self.editor) for orient in ANCHOR_ORIENTATIONS)
+            self.updateAnchors()
+        return self.anchors
     
     def updateAnchors(self):
+        if not self.anchors:
+            return
         r = self.rect()
-        size = AnchorHandle.HANDLE_SIZE
-        self.anchors["top"].setPos(r.width()/2 - size/2, -size/2)
-        self.anchors["bottom"].setPos(r.width()/2 - size/2, r.height()-size/2)
-        self.anchors["left"].setPos(-size/2, r.height()/2 - size/2)
-        self.anchors["right"].setPos(r.width()-size/2, r.height()/2 - size/2)
+        w, h = r.width(), r.height()
+        half = AnchorHandle.HANDLE_SIZE / 2
+        top, bottom, left, right = self.anchors
+        # setPos() is a no-op for unchanged positions, so only moved handles notify the scene.
+        top.setPos(w/2 - half, -half)
+        bottom.setPos(w/2 - half, h - half)
+        left.setPos(-half, h/2 - half)
+        right.setPos(w - half, h/2 - half)
+        self.reindexAnchors()
+    
+    def reindexAnchors(self):
+        # Centers and quadtree keys are recomputed lazily by the next anchorAt.
+        for anchor in self.anchors:
+            anchor._scene_center = None
+        if self.anchors and self.editor:
+            self.editor.markAnchorsDirty(self)
+    
+    def refreshConnections(self):
+        self._last_update_pos = self.scenePos()
+        self.editor.updateConnectionsForBlock(self)
     
     def mousePressEvent(self, event):
         # Always allow selection, so user can unfix via the edit panel.
@@ -213,22 +604,77 @@ class GraphBlock(QGraphicsRectItem):
             self.editor.previewLabel.hide()
         super().mousePressEvent(event)
     
+    def setAnchorsActive(self, active):
+        buttons = Qt.LeftButton if active else Qt.NoButton
+        for anchor in self.anchors:
+            anchor.setAcceptedMouseButtons(buttons)
+    
+    def hoverEnterEvent(self, event):
+        self.ensureAnchors()
+        self.setAnchorsActive(True)
+        super().hoverEnterEvent(event)
+    
+    def hoverLeaveEvent(self, event):
+        conn = self.editor.current_connection if self.editor else None
+        # Keep the handle that started an in-flight connection live until release.
+        if conn is None or conn.start_anchor.parent_block is not self:
+            self.setAnchorsActive(False)
+        super().hoverLeaveEvent(event)
+    
+    def mouseReleaseEvent(self, event):
+        super().mouseReleaseEvent(event)
+        # Flush the sub-threshold remainder of a drag. Qt moves every selected
+        # block together but only the grabber gets the release.
+        if self.editor and self.scene() is not None:
+            blocks = {item for item in self.scene().selectedItems() if isinstance(item, GraphBlock)}
+            blocks.add(self)
+            for block in blocks:
+                if block.scenePos() != block._last_update_pos:
+                    block.refreshConnections()
+    
     def itemChange(self, change, value):
         if change == QGraphicsRectItem.ItemPositionChange and self.locked:
             return self.pos()  # Prevent movement.
-        if change == QGraphicsRectItem.ItemPositionHasChanged and self.editor:
-            self.editor.updateConnectionsForBlock(self)
+        if change == QGraphicsRectItem.ItemScenePositionHasChanged:
+            self._cached_x, self._cached_y = value.x(), value.y()
+        elif (change == QGraphicsRectItem.ItemSceneHasChanged and value is not None
+              or change == QGraphicsRectItem.ItemParentHasChanged):
+            # Reparenting within a scene moves the block without a scene-position notification.
+            pos = self.scenePos()
+            self._cached_x, self._cached_y = pos.x(), pos.y()
+            # Seed the baseline so a first cluster drag isn't taken for a move of our own.
+            self._last_local_pos = self.pos()
+        if change == QGraphicsRectItem.ItemScenePositionHasChanged and self.editor:
+            # Also fires when a parent cluster moves the block.
+            self.reindexAnchors()
+            self.editor.trackBlockPosition(self)
+            moved_by_parent = self.pos() == self._last_local_pos and self.parentItem() is not None
+            self._last_local_pos = self.pos()
+            # A moving parent cluster translates our lines itself.
+            # Otherwise coalesce sub-2px moves so a drag doesn't relayout lines every pixel.
+            if not moved_by_parent and (value - self._last_update_pos).manhattanLength() >= 2:
+                self.refreshConnections()
+        elif change == QGraphicsRectItem.ItemSceneHasChanged and self.editor:
+            if value is None:
+                self.editor.dropAnchors(self)
+                self.editor.untrackBlockPosition(self)
+            else:
+                self.reindexAnchors()
+                self.editor.trackBlockPosition(self)
+        elif change == QGraphicsRectItem.ItemParentHasChanged and self.editor and self.scene() is not None:
+            self.reindexAnchors()
+            self.editor.trackBlockPosition(self)
+            self.refreshConnections()
         return super().itemChange(change, value)
 
 # -------------------------------------------
 # GraphCluster represents a grouping of blocks.
 # -------------------------------------------
 class GraphCluster(QGraphicsRectItem):
-    def __init__(self, blocks, title="Cluster", editor=None):
+    def __init__(self, blocks, title="Cluster", editor=None, locked=False):
         bounding_rect = self.computeBoundingRect(blocks)
         super().__init__(bounding_rect)
-        self.setFlags(QGraphicsRectItem.ItemIsSelectable | QGraphicsRectItem.ItemSendsScenePositionChanges)
-        self.setFlag(QGraphicsRectItem.ItemIsMovable, True)
+        self.setFlags(_item_flags(locked))
         self.editor = editor
         self.title = title
         self.color = "#ffeeaa"  # default cluster color
@@ -236,18 +682,23 @@ class GraphCluster(QGraphicsRectItem):
         self.textItem = QGraphicsTextItem(title, self)
         self.textItem.setDefaultTextColor(Qt.black)
         self.centerText()
-        self.setBrush(QBrush(QColor(self.color)))
+        self.setBrush(editor._brush(self.color) if editor else QBrush(QColor(self.color)))
         self.setZValue(-1)
-        self.locked = False  # False means movable.
+        self.locked = locked  # False means movable.
+        self._last_pos = QPointF()  # scene pos at the last connection translation
+        self.setCacheMode(QGraphicsRectItem.DeviceCoordinateCache)
     
     def computeBoundingRect(self, blocks):
         if not blocks:
             return QRectF()
-        rect = blocks[0].sceneBoundingRect()
-        for blk in blocks[1:]:
-            rect = rect.united(blk.sceneBoundingRect())
-        rect.adjust(-10, -10, 10, 10)
-        return rect
+        rects = [blk.sceneBoundingRect() for blk in blocks]
+        arr = np.fromiter(
+            (v for r in rects for v in (r.left(), r.top(), r.right(), r.bottom())),
+            dtype=np.float64, count=4 * len(rects)
+        ).reshape(-1, 4)
+        x0, y0 = arr[:, 0].min(), arr[:, 1].min()
+        x1, y1 = arr[:, 2].max(), arr[:, 3].max()
+        return QRectF(x0 - 10, y0 - 10, x1 - x0 + 20, y1 - y0 + 20)
     
     def centerText(self):
         rect = self.rect()
@@ -278,8 +729,10 @@ class GraphCluster(QGraphicsRectItem):
     def itemChange(self, change, value):
         if change == QGraphicsRectItem.ItemPositionChange and self.locked:
             return self.pos()  # Prevent movement.
-        if change == QGraphicsRectItem.ItemPositionHasChanged and self.editor:
-            self.editor.updateConnectionsForCluster(self)
+        if change == QGraphicsRectItem.ItemScenePositionHasChanged and self.editor:
+            delta = value - self._last_pos
+            self._last_pos = value
+            self.editor.translateClusterConnections(self, delta.x(), delta.y())
         return super().itemChange(change, value)
 
 # -------------------------------------------
@@ -288,21 +741,22 @@ class GraphCluster(QGraphicsRectItem):
 class CustomScene(QGraphicsScene):
     def __init__(self, editor, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # Blocks and clusters are movable, so a BSP index would be rebuilt on
+        # every drag; anchor hit-testing goes through editor.anchor_index instead.
+        self.setItemIndexMethod(QGraphicsScene.NoIndex)
         self.editor = editor
     
     def mouseMoveEvent(self, event):
         if self.editor.current_connection:
-            self.editor.current_connection.update_line_item(current_pos=event.scenePos())
+            # Coalesce high-rate mouse events; only the latest position is drawn.
+            self.editor._pending_pos = event.scenePos()
+            if not self.editor._connectionTimer.isActive():
+                self.editor._connectionTimer.start()
         super().mouseMoveEvent(event)
     
     def mouseReleaseEvent(self, event):
         if self.editor.current_connection:
-            items_at_pos = self.items(event.scenePos())
-            target_anchor = None
-            for item in items_at_pos:
-                if isinstance(item, AnchorHandle):
-                    target_anchor = item
-                    break
+            target_anchor = self.editor.anchorAt(event.scenePos())
             if target_anchor:
                 # Handled by AnchorHandle.
                 pass
@@ -323,10 +777,32 @@ class GraphEditor(QMainWindow):
         self.blocks = {}      # block_id -> GraphBlock
         self.clusters = {}    # cluster_id -> GraphCluster
         self.connections = [] # list of GraphConnection objects
+        self.connections_by_block = defaultdict(set)  # block_id -> set of GraphConnection
         self.currentBlock = None      # currently selected block
         self.currentCluster = None    # currently selected cluster
         self.editLocked = False       # edit panel locked
         self.current_connection = None  # active connection being drawn
+        # Structure-of-arrays mirror of block scene positions and sizes (x, y, w, h)
+        # for vectorized queries.
+        self._block_pos = np.empty((0, 4), np.float64)
+        self._block_ids = np.empty((0,), np.int32)
+        self._block_rows = {}  # block_id -> row in _block_pos/_block_ids
+        self._block_count = 0
+        self.anchor_index = QuadTree(bounds=(0, 0, 3000, 3000), capacity=10, max_depth=8)
+        self._dirty_anchor_blocks = set()  # blocks whose anchors moved since the last anchorAt
+        self._pending_pos = None        # latest cursor position for the active connection
+        self._connectionTimer = QTimer(self)
+        self._connectionTimer.setSingleShot(True)
+        self._connectionTimer.setInterval(16)  # ~60 Hz
+        self._connectionTimer.timeout.connect(self.flushPendingConnection)
+        self._latexWorker = None         # in-flight LaTeX render, if any
+        self._brush_cache = {}           # hex color -> QBrush
+        self._cullBounds = QRectF()      # expanded viewport used for the last culling pass
+        self._pendingScale = 1.0         # wheel zoom accumulated since the last applied frame
+        self._scaleTimer = QTimer(self)
+        self._scaleTimer.setSingleShot(True)
+        self._scaleTimer.setInterval(16)  # ~60 Hz
+        self._scaleTimer.timeout.connect(self._applyScale)
         self.initUI()
     
     def initUI(self):
@@ -334,8 +810,15 @@ class GraphEditor(QMainWindow):
         # Use our custom view which supports panning.
         self.view = MyGraphicsView(self.scene, self)
         self.view.setRenderHints(QPainter.Antialiasing)
-        self.view.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
+        # Many small items: repainting everything is cheaper than dirty-rect bookkeeping.
+        self.view.setViewportUpdateMode(QGraphicsView.FullViewportUpdate)
+        self.view.setOptimizationFlag(QGraphicsView.DontAdjustForAntialiasing, True)
+        self.view.setOptimizationFlag(QGraphicsView.DontSavePainterState, True)
+        # Block culling and connection line creation share this one trigger.
+        self.view.viewChanged.connect(self._recullIfNeeded)
         self.setCentralWidget(self.view)
+        # Rendered LaTeX previews live in QPixmapCache (limit in KiB).
+        QPixmapCache.setCacheLimit(50 * 1024)
         
         self.createMenus()
         self.createToolBar()
@@ -372,8 +855,8 @@ class GraphEditor(QMainWindow):
         deleteAction.triggered.connect(self.deleteSelected)
         groupAction.triggered.connect(self.groupSelectedBlocks)
         changeColorAction.triggered.connect(self.changeColor)
-        zoomInAction.triggered.connect(lambda: self.view.scale(1.15, 1.15))
-        zoomOutAction.triggered.connect(lambda: self.view.scale(1/1.15, 1/1.15))
+        zoomInAction.triggered.connect(lambda: self.scaleView(1.15))
+        zoomOutAction.triggered.connect(lambda: self.scaleView(1/1.15))
         
         toolbar.addAction(addBlockAction)
         toolbar.addAction(deleteAction)
@@ -460,21 +943,37 @@ class GraphEditor(QMainWindow):
         if not latex_code.strip():
             QMessageBox.warning(self, "Помилка", "LaTeX код порожній!")
             return
-        try:
-            fig = plt.figure(figsize=(0.01, 0.01))
-            fig.text(0, 0, r"${}$".format(latex_code), fontsize=20)
-            buf = BytesIO()
-            plt.axis("off")
-            plt.savefig(buf, format="png", bbox_inches="tight", pad_inches=0.1)
-            plt.close(fig)
-            buf.seek(0)
-            image = QImage.fromData(buf.getvalue())
-            pixmap = QPixmap.fromImage(image)
-            self.previewLabel.setPixmap(pixmap)
-            self.latexEdit.hide()
-            self.previewLabel.show()
-        except Exception as e:
-            QMessageBox.critical(self, "Помилка", f"Помилка відтворення LaTeX: {e}")
+        key = "latex:" + hashlib.md5(latex_code.encode("utf-8")).hexdigest()
+        pixmap = QPixmapCache.find(key)
+        if pixmap is not None:
+            self.showLatexPreview(pixmap)
+            return
+        # Render off the GUI thread; the button stays disabled until it finishes.
+        self.previewButton.setEnabled(False)
+        self._latexWorker = LatexWorker(key, latex_code, self.currentBlock)
+        self._latexWorker.signals.done.connect(self.onLatexRendered)
+        self._latexWorker.signals.failed.connect(self.onLatexFailed)
+        QThreadPool.globalInstance().start(self._latexWorker)
+    
+    def onLatexRendered(self, key, image):
+        self.previewButton.setEnabled(True)
+        worker, self._latexWorker = self._latexWorker, None
+        pixmap = QPixmap.fromImage(image)
+        QPixmapCache.insert(key, pixmap)
+        # The selection or text may have changed mid-render; then just keep the cache entry.
+        if (worker is not None and worker.block is self.currentBlock
+                and worker.latex_code == self.latexEdit.toPlainText()):
+            self.showLatexPreview(pixmap)
+    
+    def onLatexFailed(self, message):
+        self.previewButton.setEnabled(True)
+        self._latexWorker = None
+        QMessageBox.critical(self, "Помилка", f"Помилка відтворення LaTeX: {message}")
+    
+    def showLatexPreview(self, pixmap):
+        self.previewLabel.setPixmap(pixmap)
+        self.latexEdit.hide()
+        self.previewLabel.show()
     
     def editLatex(self):
         self.previewLabel.hide()
@@ -530,7 +1029,7 @@ class GraphEditor(QMainWindow):
         x = random.randint(0, 400)
         y = random.randint(0, 300)
         block.setPos(x, y)
-        block.setBrush(QBrush(QColor(block.color)))
+        block.setBrush(self._brush(block.color))
         self.scene.addItem(block)
         if not self.editDock.isVisible():
             self.editDock.show()
@@ -541,14 +1040,10 @@ class GraphEditor(QMainWindow):
         for item in self.scene.selectedItems():
             if isinstance(item, GraphBlock):
                 if item.block_id in self.blocks:
-                    conns_to_remove = [conn for conn in self.connections 
-                                       if conn.start_anchor.parent_block == item or 
-                                       (conn.end_anchor and conn.end_anchor.parent_block == item)]
-                    for conn in conns_to_remove:
+                    for conn in list(self.connections_by_block.get(item.block_id, ())):
                         if conn.line_item:
                             self.scene.removeItem(conn.line_item)
-                        if conn in self.connections:
-                            self.connections.remove(conn)
+                        self.unregisterConnection(conn)
                     self.scene.removeItem(item)
                     del self.blocks[item.block_id]
                     print(f"Видалено блок {item.block_id}")
@@ -588,9 +1083,13 @@ class GraphEditor(QMainWindow):
         # Attach blocks within the cluster's bounding area.
         if self.currentCluster:
             attached = []
-            cluster_rect = self.currentCluster.sceneBoundingRect()
-            for block in self.blocks.values():
-                if block.parentItem() is None and cluster_rect.contains(block.scenePos()):
+            r = self.currentCluster.sceneBoundingRect()
+            n = self._block_count
+            xs, ys = self._block_pos[:n, 0], self._block_pos[:n, 1]
+            mask = (xs >= r.left()) & (xs <= r.right()) & (ys >= r.top()) & (ys <= r.bottom())
+            for block_id in self._block_ids[:n][mask]:
+                block = self.blocks[int(block_id)]
+                if block.parentItem() is None:
                     block.setParentItem(self.currentCluster)
                     attached.append(block.block_id)
                     if block not in self.currentCluster.blocks:
@@ -624,7 +1123,7 @@ class GraphEditor(QMainWindow):
             return
         self.current_connection = GraphConnection(anchor, self.scene)
         self.current_connection.create_line_item()
-        print(f"Почато з'єднання з анкера {anchor.orientation} блоку {anchor.parent_block.block_id}")
+        log.debug("Почато з'єднання з анкера %s блоку %s", anchor.orientation, anchor.parent_block.block_id)
     
     def endConnection(self, anchor):
         if not self.current_connection:
@@ -632,8 +1131,11 @@ class GraphEditor(QMainWindow):
         if anchor.parent_block != self.current_connection.start_anchor.parent_block:
             self.current_connection.end_anchor = anchor
             self.current_connection.update_line_item()
-            self.connections.append(self.current_connection)
-            print(f"З'єднання створено між блоком {self.current_connection.start_anchor.parent_block.block_id} ({self.current_connection.start_anchor.orientation}) та блоком {anchor.parent_block.block_id} ({anchor.orientation})")
+            self.registerConnection(self.current_connection)
+            log.debug("З'єднання створено між блоком %s (%s) та блоком %s (%s)",
+                      self.current_connection.start_anchor.parent_block.block_id,
+                      self.current_connection.start_anchor.orientation,
+                      anchor.parent_block.block_id, anchor.orientation)
         else:
             self.cancelConnection()
         self.current_connection = None
@@ -642,36 +1144,220 @@ class GraphEditor(QMainWindow):
         if self.current_connection and self.current_connection.line_item:
             self.scene.removeItem(self.current_connection.line_item)
         self.current_connection = None
-        print("З'єднання скасовано.")
+        log.debug("З'єднання скасовано.")
+    
+    def _brush(self, hexstr):
+        brush = self._brush_cache.get(hexstr)
+        if brush is None:
+            brush = self._brush_cache[hexstr] = QBrush(QColor(hexstr))
+        return brush
     
     def changeColor(self):
         color = QColorDialog.getColor()
         if color.isValid():
             if self.currentBlock:
                 self.currentBlock.color = color.name()
-                self.currentBlock.setBrush(QBrush(color))
+                self.currentBlock.setBrush(self._brush(color.name()))
                 print("Змінено колір блоку на:", color.name())
             if self.currentCluster:
                 self.currentCluster.color = color.name()
-                self.currentCluster.setBrush(QBrush(color))
+                self.currentCluster.setBrush(self._brush(color.name()))
                 print("Змінено колір кластера на:", color.name())
     
+    def trackBlockPosition(self, block):
+        if block.block_id is None:
+            return
+        row = self._block_rows.get(block.block_id)
+        if row is None:
+            row = self._block_count
+            if row == len(self._block_ids):
+                grow = max(16, row)  # amortized doubling
+                self._block_pos = np.concatenate((self._block_pos, np.empty((grow, 4), np.float64)))
+                self._block_ids = np.concatenate((self._block_ids, np.empty((grow,), np.int32)))
+            self._block_ids[row] = block.block_id
+            self._block_rows[block.block_id] = row
+            self._block_count += 1
+        pos = block.scenePos()
+        self._block_pos[row] = (pos.x(), pos.y(), block._cached_w, block._cached_h)
+    
+    def untrackBlockPosition(self, block):
+        row = self._block_rows.pop(block.block_id, None)
+        if row is None:
+            return
+        last = self._block_count - 1
+        if row != last:
+            # Swap-remove: move the last row into the freed slot.
+            self._block_pos[row] = self._block_pos[last]
+            moved_id = int(self._block_ids[last])
+            self._block_ids[row] = moved_id
+            self._block_rows[moved_id] = row
+        self._block_count = last
+    
+    def markAnchorsDirty(self, block):
+        self._dirty_anchor_blocks.add(block)
+    
+    def dropAnchors(self, block):
+        self._dirty_anchor_blocks.discard(block)
+        for anchor in block.anchors:
+            self.anchor_index.remove(anchor)
+    
+    def _flushAnchorIndex(self):
+        # Re-key anchors of blocks that moved since the last query.
+        dirty, self._dirty_anchor_blocks = self._dirty_anchor_blocks, set()
+        for block in dirty:
+            if block.scene() is not None:
+                self.anchor_index.update(block.anchors)
+    
+    def _reboundAnchorIndex(self):
+        r = self.scene.sceneRect()
+        self.anchor_index.rebuild((r.x(), r.y(), r.width(), r.height()))
+    
+    def anchorAt(self, pos, exclude=None):
+        # Nearest anchor whose handle contains pos, via the quadtree.
+        r = AnchorHandle.HANDLE_SIZE / 2
+        area = QRectF(pos.x() - r, pos.y() - r, 2 * r, 2 * r)
+        # The start anchor grabs the mouse, so hover never reached the blocks
+        # under pos; give just those their anchors before querying.
+        n = self._block_count
+        geo = self._block_pos[:n]
+        px, py = pos.x(), pos.y()
+        mask = ((geo[:, 0] - r <= px) & (px <= geo[:, 0] + geo[:, 2] + r)
+                & (geo[:, 1] - r <= py) & (py <= geo[:, 1] + geo[:, 3] + r))
+        for block_id in self._block_ids[:n][mask]:
+            block = self.blocks[int(block_id)]
+            if block.isVisible():
+                block.ensureAnchors()
+        self._flushAnchorIndex()
+        best, best_d2 = None, r * r
+        for anchor, x, y in self.anchor_index.query(area):
+            if anchor is exclude or not anchor.isVisible():
+                continue
+            d2 = (x - pos.x()) ** 2 + (y - pos.y()) ** 2
+            if d2 <= best_d2:
+                best, best_d2 = anchor, d2
+        return best
+    
+    def flushPendingConnection(self):
+        if self.current_connection and self._pending_pos is not None:
+            self.current_connection.update_line_item(current_pos=self._pending_pos)
+        self._pending_pos = None
+    
+    def registerConnection(self, conn):
+        self.connections.append(conn)
+        if conn.line_item:
+            # Only finished connections are cached; the in-flight line changes every frame.
+            conn.line_item.setCacheMode(QGraphicsLineItem.DeviceCoordinateCache)
+        for anchor in (conn.start_anchor, conn.end_anchor):
+            if anchor is not None:
+                self.connections_by_block[anchor.parent_block.block_id].add(conn)
+    
+    def unregisterConnection(self, conn):
+        if conn in self.connections:
+            self.connections.remove(conn)
+        for anchor in (conn.start_anchor, conn.end_anchor):
+            if anchor is None:
+                continue
+            conns = self.connections_by_block.get(anchor.parent_block.block_id)
+            if conns is not None:
+                conns.discard(conn)
+                if not conns:
+                    del self.connections_by_block[anchor.parent_block.block_id]
+    
+    def showConnectionLine(self, conn, segment=None):
+        conn.create_line_item(segment)
+        conn.line_item.setCacheMode(QGraphicsLineItem.DeviceCoordinateCache)
+    
+    def hideConnectionLine(self, conn):
+        self.scene.removeItem(conn.line_item)
+        conn.line_item = None
+    
+    def _refreshConnectionVisibility(self, rect):
+        # Create line items for connections whose bounding box meets rect and
+        # drop the ones that left it; endpoints come from one vectorized pass.
+        segs = _connection_segments(self.connections)
+        lo_x, hi_x = np.minimum(segs[:, 0], segs[:, 2]), np.maximum(segs[:, 0], segs[:, 2])
+        lo_y, hi_y = np.minimum(segs[:, 1], segs[:, 3]), np.maximum(segs[:, 1], segs[:, 3])
+        visible = ((hi_x >= rect.left()) & (lo_x <= rect.right()) &
+                   (hi_y >= rect.top()) & (lo_y <= rect.bottom()))
+        for conn, segment, vis in zip(self.connections, segs.tolist(), visible.tolist()):
+            if vis and conn.line_item is None:
+                self.showConnectionLine(conn, segment)
+            elif not vis and conn.line_item is not None:
+                self.hideConnectionLine(conn)
+    
     def updateConnectionsForBlock(self, block):
-        for conn in self.connections:
-            if conn.start_anchor.parent_block == block or (conn.end_anchor and conn.end_anchor.parent_block == block):
+        for conn in self.connections_by_block.get(block.block_id, ()):
+            if conn.line_item is None:
+                self.showConnectionLine(conn)  # culled line dragged back into play
+            else:
                 conn.update_line_item()
         if self.current_connection and self.current_connection.start_anchor.parent_block == block:
             self.current_connection.update_line_item()
     
-    def updateConnectionsForCluster(self, cluster):
-        for blk in cluster.blocks:
-            self.updateConnectionsForBlock(blk)
+    def translateClusterConnections(self, cluster, dx, dy):
+        # Every member block moved by the same delta, so shift the affected
+        # line endpoints directly instead of re-deriving them from anchors.
+        if not (dx or dy):
+            return
+        # Clusters built by openFile don't reparent their blocks, so only
+        # children actually move with the cluster.
+        members = {blk for blk in cluster.blocks if blk.parentItem() is cluster}
+        seen = set()
+        for blk in members:
+            for conn in self.connections_by_block.get(blk.block_id, ()):
+                if conn in seen:
+                    continue
+                seen.add(conn)
+                if not conn.line_item:
+                    # Culled line dragged back into play. Member blocks haven't seen
+                    # this move yet, so their cached geometry is the pre-move one.
+                    self.showConnectionLine(conn, _connection_segments([conn])[0].tolist())
+                line = conn.line_item.line()
+                sdx, sdy = (dx, dy) if conn.start_anchor.parent_block in members else (0, 0)
+                edx, edy = (dx, dy) if conn.end_anchor and conn.end_anchor.parent_block in members else (0, 0)
+                conn.line_item.setLine(line.x1() + sdx, line.y1() + sdy, line.x2() + edx, line.y2() + edy)
+    
+    @contextmanager
+    def suspendedViewUpdates(self):
+        # Bulk scene edits: no intermediate paints, one full repaint at the end.
+        old_mode = self.view.viewportUpdateMode()
+        self.view.setViewportUpdateMode(QGraphicsView.NoViewportUpdate)
+        self.view.setUpdatesEnabled(False)
+        # Don't emit changed/selectionChanged once per inserted item.
+        was_blocked = self.scene.blockSignals(True)
+        try:
+            yield
+        finally:
+            self.scene.blockSignals(was_blocked)
+            self.view.setUpdatesEnabled(True)
+            self.view.setViewportUpdateMode(old_mode)
+            self.scene.update()
+    
+    def fitSceneRect(self, xs, ys, ws, hs, margin=100):
+        # Grow the scene once to cover every loaded block, instead of leaving
+        # far-away blocks outside the scrollable area.
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        right = (xs + np.asarray(ws, dtype=np.float64)).max()
+        bottom = (ys + np.asarray(hs, dtype=np.float64)).max()
+        left, top = xs.min(), ys.min()
+        bounds = QRectF(left - margin, top - margin, right - left + 2 * margin, bottom - top + 2 * margin)
+        self.scene.setSceneRect(self.scene.sceneRect().united(bounds))
+        self._reboundAnchorIndex()
     
     def newFile(self):
         self.scene.clear()
+        self.scene.setSceneRect(0, 0, 3000, 3000)
+        self._cullBounds = QRectF()
+        self.anchor_index.clear()
+        self._dirty_anchor_blocks.clear()
+        self._reboundAnchorIndex()
+        self._block_rows.clear()
+        self._block_count = 0
         self.blocks.clear()
         self.clusters.clear()
         self.connections.clear()
+        self.connections_by_block.clear()
         self.block_id_counter = 1
         self.cluster_id_counter = 1
         self.currentBlock = None
@@ -682,128 +1368,164 @@ class GraphEditor(QMainWindow):
         options = QFileDialog.Options()
         filename, _ = QFileDialog.getOpenFileName(self, "Відкрити файл", "", "JSON Files (*.json);;All Files (*)", options=options)
         if filename:
-            with open(filename, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            cache, stamp = _graph_cache_path(filename), _graph_cache_stamp(filename)
+            sections = _read_graph_cache(cache, stamp) if cache is not None and cache.exists() else None
+            from_cache = sections is not None
+            if not from_cache:
+                sections = _read_graph_sections(filename)
+            blocks_data, clusters_data, connections_data = sections
             self.newFile()
-            for block_data in data.get("blocks", []):
-                rect = QRectF(0, 0, block_data["width"], block_data["height"])
-                block = GraphBlock(rect, block_data["title"], editor=self)
-                block.block_id = block_data["id"]
-                block.content = block_data.get("content", "")
-                block.color = block_data.get("color", "#ffffff")
-                block.setBrush(QBrush(QColor(block.color)))
-                block.setPos(block_data["x"], block_data["y"])
-                block.locked = block_data.get("locked", False)
-                if block.locked:
-                    block.setFlag(QGraphicsRectItem.ItemIsMovable, False)
-                self.blocks[block.block_id] = block
-                self.scene.addItem(block)
-                if block.block_id >= self.block_id_counter:
-                    self.block_id_counter = block.block_id + 1
-            for cluster_data in data.get("clusters", []):
-                cluster_blocks = []
-                for bid in cluster_data.get("block_ids", []):
-                    if bid in self.blocks:
-                        cluster_blocks.append(self.blocks[bid])
-                if cluster_blocks:
-                    cluster = GraphCluster(cluster_blocks, title=cluster_data["title"], editor=self)
-                    cluster.color = cluster_data.get("color", "#ffeeaa")
-                    cluster.setBrush(QBrush(QColor(cluster.color)))
-                    cluster.locked = cluster_data.get("locked", False)
-                    if cluster.locked:
-                        cluster.setFlag(QGraphicsRectItem.ItemIsMovable, False)
-                    self.clusters[cluster_data["id"]] = cluster
-                    self.scene.addItem(cluster)
-            for conn_data in data.get("connections", []):
-                start_id = conn_data["start_block_id"]
-                end_id = conn_data["end_block_id"]
-                start_orientation = conn_data["start_anchor"]
-                end_orientation = conn_data["end_anchor"]
-                if start_id in self.blocks and end_id in self.blocks:
-                    start_block = self.blocks[start_id]
-                    end_block = self.blocks[end_id]
-                    start_anchor = start_block.anchors.get(start_orientation)
-                    end_anchor = end_block.anchors.get(end_orientation)
-                    conn = GraphConnection(start_anchor, self.scene)
-                    conn.end_anchor = end_anchor
-                    conn.create_line_item()
-                    conn.update_line_item()
-                    self.connections.append(conn)
+            with self.suspendedViewUpdates():
+                xs, ys, ws, hs = [], [], [], []
+                # Local aliases keep attribute lookups out of the per-block loop.
+                blocks = self.blocks
+                addItem = self.scene.addItem
+                brush = self._brush
+                for block_data in blocks_data:
+                    x, y = block_data["x"], block_data["y"]
+                    width, height = block_data["width"], block_data["height"]
+                    block = GraphBlock(QRectF(0, 0, width, height), block_data["title"], editor=self,
+                                       locked=block_data.get("locked", False), pos=QPointF(x, y))
+                    block.block_id = block_data["id"]
+                    block.content = block_data.get("content", "")
+                    block.color = block_data.get("color", "#ffffff")
+                    block.setBrush(brush(block.color))
+                    blocks[block.block_id] = block
+                    addItem(block)
+                    xs.append(x)
+                    ys.append(y)
+                    ws.append(width)
+                    hs.append(height)
+                self.block_id_counter = max(self.blocks, default=0) + 1
+                for cluster_data in clusters_data:
+                    cluster_blocks = []
+                    for bid in cluster_data.get("block_ids", []):
+                        if bid in self.blocks:
+                            cluster_blocks.append(self.blocks[bid])
+                    if cluster_blocks:
+                        cluster = GraphCluster(cluster_blocks, title=cluster_data["title"], editor=self,
+                                               locked=cluster_data.get("locked", False))
+                        cluster.color = cluster_data.get("color", "#ffeeaa")
+                        cluster.setBrush(self._brush(cluster.color))
+                        self.clusters[cluster_data["id"]] = cluster
+                        self.scene.addItem(cluster)
+                for conn_data in connections_data:
+                    start_id = conn_data["start_block_id"]
+                    end_id = conn_data["end_block_id"]
+                    start_orientation = conn_data["start_anchor"]
+                    end_orientation = conn_data["end_anchor"]
+                    if start_id in self.blocks and end_id in self.blocks:
+                        start_block = self.blocks[start_id]
+                        end_block = self.blocks[end_id]
+                        start_code = _ORIENT_CODES.get(start_orientation)
+                        end_code = _ORIENT_CODES.get(end_orientation)
+                        if start_code is None or end_code is None:
+                            continue
+                        start_anchor = start_block.ensureAnchors()[start_code]
+                        end_anchor = end_block.ensureAnchors()[end_code]
+                        conn = GraphConnection(start_anchor, self.scene)
+                        conn.end_anchor = end_anchor
+                        # Line items are created by the culling pass, only for visible connections.
+                        self.registerConnection(conn)
+            # Outside the suspended block so sceneRectChanged reaches the view.
+            if xs:
+                self.fitSceneRect(xs, ys, ws, hs)
+            self._recullIfNeeded()
+            if not from_cache and cache is not None:
+                self.writeGraphCache(cache, stamp)
             print("Відкрито файл:", filename)
     
+    def writeGraphCache(self, cache, stamp):
+        # Snapshot of what was just loaded, in the same record shape as the JSON.
+        sections = (
+            [asdict(_block_snap(block)) for block in self.blocks.values()],
+            [asdict(_cluster_snap(cid, cluster)) for cid, cluster in self.clusters.items()],
+            [asdict(_conn_snap(conn)) for conn in self.connections if conn.end_anchor],
+        )
+        try:
+            cache.parent.mkdir(parents=True, exist_ok=True)
+            cache.write_bytes(pickle.dumps((stamp, sections), protocol=5))
+        except OSError as e:
+            log.debug("Could not write graph cache %s: %s", cache, e)
+    
     def saveFile(self):
         options = QFileDialog.Options()
         filename, _ = QFileDialog.getSaveFileName(self, "Зберегти файл", "", "JSON Files (*.json);;All Files (*)", options=options)
         if filename:
-            data = {"blocks": [], "clusters": [], "connections": []}
-            for block in self.blocks.values():
-                pos = block.scenePos()
-                rect = block.rect()
-                block_data = {
-                    "id": block.block_id,
-                    "title": block.title,
-                    "content": block.content,
-                    "x": pos.x(),
-                    "y": pos.y(),
-                    "width": rect.width(),
-                    "height": rect.height(),
-                    "color": block.color,
-                    "locked": block.locked
-                }
-                data["blocks"].append(block_data)
-            for cid, cluster in self.clusters.items():
-                cluster_data = {
-                    "id": cid,
-                    "title": cluster.title,
-                    "color": cluster.color,
-                    "block_ids": [blk.block_id for blk in cluster.blocks],
-                    "locked": cluster.locked
-                }
-                data["clusters"].append(cluster_data)
-            for conn in self.connections:
-                if not conn.end_anchor:
-                    continue
-                conn_data = {
-                    "start_block_id": conn.start_anchor.parent_block.block_id,
-                    "start_anchor": conn.start_anchor.orientation,
-                    "end_block_id": conn.end_anchor.parent_block.block_id,
-                    "end_anchor": conn.end_anchor.orientation
-                }
-                data["connections"].append(conn_data)
-            with open(filename, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
+            # Records are generated and written one at a time.
+            sections = (
+                ("blocks", (_block_snap(block) for block in self.blocks.values())),
+                ("clusters", (_cluster_snap(cid, cluster) for cid, cluster in self.clusters.items())),
+                ("connections", (_conn_snap(conn) for conn in self.connections if conn.end_anchor)),
+            )
+            with open(filename, "wb") as f:
+                _write_json_sections(f, sections)
             print("Збережено файл:", filename)
     
+    def _editedSize(self, rect):
+        # Empty fields keep the current size without going through the exception path.
+        width_text, height_text = self.widthEdit.text(), self.heightEdit.text()
+        if width_text and height_text:
+            try:
+                return float(width_text), float(height_text)
+            except ValueError:
+                pass
+        return rect.width(), rect.height()
+    
     def saveEdit(self):
         if self.currentBlock:
             title = self.titleEdit.text()
             content = self.latexEdit.toPlainText()
-            try:
-                width = float(self.widthEdit.text())
-                height = float(self.heightEdit.text())
-            except ValueError:
-                width, height = self.currentBlock.rect().width(), self.currentBlock.rect().height()
+            rect = self.currentBlock.rect()
+            width, height = self._editedSize(rect)
             self.currentBlock.setTitle(title)
             self.currentBlock.content = content
-            newRect = QRectF(0, 0, width, height)
-            self.currentBlock.setBlockRect(newRect)
+            if (width, height) != (rect.width(), rect.height()):
+                self.currentBlock.setBlockRect(QRectF(0, 0, width, height))
             print("Збережено зміни для блоку:", title)
         elif self.currentCluster:
             title = self.titleEdit.text()
-            try:
-                width = float(self.widthEdit.text())
-                height = float(self.heightEdit.text())
-            except ValueError:
-                width, height = self.currentCluster.rect().width(), self.currentCluster.rect().height()
+            rect = self.currentCluster.rect()
+            width, height = self._editedSize(rect)
             self.currentCluster.setTitle(title)
-            newRect = QRectF(self.currentCluster.rect().x(), self.currentCluster.rect().y(), width, height)
+            if (width, height) != (rect.width(), rect.height()):
+                self.currentCluster.setClusterRect(QRectF(rect.x(), rect.y(), width, height))
+            print("Збережено зміни для кластера:", title)
+    
+    def scaleView(self, factor):
+        self.view.scale(factor, factor)
+        self._recullIfNeeded()
+    
+    def _recullIfNeeded(self):
+        # Hide blocks outside the viewport plus a 20% margin; only recompute
+        # once the viewport leaves the bounds of the previous pass.
+        vp = self.view.mapToScene(self.view.viewport().rect()).boundingRect()
+        if self._cullBounds.contains(vp):
+            return
+        dx, dy = vp.width() * 0.2, vp.height() * 0.2
+        self._cullBounds = vp.adjusted(-dx, -dy, dx, dy)
+        for block in self.blocks.values():
+            # Hiding deselects in Qt, and cluster children move without a viewport
+            # change, so selected and parented blocks always stay shown.
+            block.setVisible(block.isSelected() or block.parentItem() is not None
+                             or self._cullBounds.intersects(block.sceneBoundingRect()))
+        self._refreshConnectionVisibility(self._cullBounds)
+    
+    def invalidateCulling(self):
+        self._cullBounds = QRectF()
+        self._recullIfNeeded()
+    
+    def _applyScale(self):
+        factor, self._pendingScale = self._pendingScale, 1.0
+        if factor != 1.0:
+            self.scaleView(factor)
     
     def wheelEvent(self, event):
+        # A burst of wheel steps collapses into one transform update per frame.
         factor = 1.15
-        if event.angleDelta().y() > 0:
-            self.view.scale(factor, factor)
-        else:
-            self.view.scale(1/factor, 1/factor)
+        self._pendingScale *= factor if event.angleDelta().y() > 0 else 1/factor
+        if not self._scaleTimer.isActive():
+            self._scaleTimer.start()
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)